@@ -293,6 +293,12 @@ class BuildCommandViewSet(DisableListEndpoint, UserSelectViewSet):
     serializer_class = BuildCommandSerializer
     model = BuildCommandResult
 
+    def get_serializer(self, *args, **kwargs):
+        """Allow creating multiple commands in a single request."""
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+        return super().get_serializer(*args, **kwargs)
+
 
 class DomainViewSet(DisableListEndpoint, UserSelectViewSet):
     permission_classes = [APIRestrictedPermission]
@@ -26,6 +26,9 @@ if old_config:
     )
     DOCKER_IMAGE_SETTINGS.update(old_config)
 
+RTD_DOCKER_COMPOSE = settings.RTD_DOCKER_COMPOSE
+RTD_DOCKER_ADDITIONAL_BINDS = settings.RTD_DOCKER_ADDITIONAL_BINDS
+
 DOCKER_TIMEOUT_EXIT_CODE = 42
 DOCKER_OOM_EXIT_CODE = 137
 
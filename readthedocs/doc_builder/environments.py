@@ -1,22 +1,21 @@
 """Documentation Builder Environments."""
 
+import itertools
 import structlog
 import os
-import re
 import socket
 import subprocess
 import sys
-import uuid
+import threading
+import time
+from collections import deque
 from datetime import datetime
+from pathlib import Path
 
 from django.conf import settings
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
-from docker import APIClient
-from docker.errors import APIError as DockerAPIError
-from docker.errors import DockerException
-from docker.errors import NotFound as DockerNotFoundError
 from requests.exceptions import ConnectionError, ReadTimeout
-from requests_toolbelt.multipart.encoder import MultipartEncoder
 from slumber.exceptions import HttpClientError
 
 from readthedocs.api.v2.client import api as api_v2
@@ -37,6 +36,8 @@ from .constants import (
     DOCKER_SOCKET,
     DOCKER_TIMEOUT_EXIT_CODE,
     DOCKER_VERSION,
+    RTD_DOCKER_ADDITIONAL_BINDS,
+    RTD_DOCKER_COMPOSE,
 )
 from .exceptions import (
     BuildEnvironmentCreationFailed,
@@ -52,6 +53,89 @@ from .exceptions import (
 
 log = structlog.get_logger(__name__)
 
+# Size of the chunks used to read the output of running commands
+OUTPUT_READ_CHUNK_SIZE = 64 * 1024
+
+# ``docker`` is only needed by the Docker build environments, and importing
+# it is expensive. It's loaded on first use (see ``_load_docker``) to keep it
+# out of the startup path of non-docker entry points (tests, local builds,
+# most management commands).
+APIClient = None
+DockerAPIError = None
+DockerException = None
+DockerNotFoundError = None
+
+
+def _load_docker():
+    """Import the Docker client library on first use."""
+    global APIClient, DockerAPIError, DockerException, DockerNotFoundError
+    if DockerException is None:
+        import docker
+
+        # ``APIClient`` may have been replaced already (tests mock it at
+        # module level), keep whatever is there in that case
+        if APIClient is None:
+            APIClient = docker.APIClient
+        DockerAPIError = docker.errors.APIError
+        DockerException = docker.errors.DockerException
+        DockerNotFoundError = docker.errors.NotFound
+
+
+# Tags the containers created for sync (no build) environments, which need a
+# unique name per container (see ``get_container_name``)
+_sync_container_count = itertools.count()
+
+# Docker clients shared by all the environments of this process, keyed by
+# (socket, API version). See ``get_docker_client``.
+_DOCKER_CLIENTS = {}
+_DOCKER_CLIENTS_LOCK = threading.Lock()
+
+# Image hashes cached per image tag for the lifetime of the worker process,
+# where build images are effectively immutable. See ``image_hash``.
+_IMAGE_HASH_CACHE = {}
+
+
+def get_docker_client(docker_socket=DOCKER_SOCKET):
+    """
+    Return a Docker client connected to ``docker_socket``.
+
+    Clients are shared process-wide: every ``APIClient`` pays the socket
+    handshake and HTTP session setup on creation, so builds running on the
+    same worker reuse a single long-lived client per socket instead of
+    creating one per build.
+    """
+    _load_docker()
+    key = (docker_socket, DOCKER_VERSION)
+    with _DOCKER_CLIENTS_LOCK:
+        client = _DOCKER_CLIENTS.get(key)
+        if client is None:
+            client = APIClient(
+                base_url=docker_socket,
+                version=DOCKER_VERSION,
+                # The client is shared by all the builds of this worker, give
+                # the underlying urllib3 pool enough room for their concurrent
+                # requests (the default pool size is 10)
+                max_pool_size=32,
+            )
+            _DOCKER_CLIENTS[key] = client
+    return client
+
+
+def warm_docker_client(docker_socket=DOCKER_SOCKET):
+    """
+    Create and verify the shared Docker client eagerly.
+
+    Called at worker boot (see ``readthedocs.worker``) so the first build
+    doesn't pay the socket handshake on its critical path. Failures are only
+    logged: the daemon may simply not be up yet, and ``get_client`` handles
+    the error properly once a build needs the client.
+    """
+    try:
+        get_docker_client(docker_socket).ping()
+    except Exception:  # noqa
+        log.exception('Unable to warm up the Docker client.')
+
+
 __all__ = (
     'api_v2',
     'BuildCommand',
@@ -104,7 +188,9 @@ class BuildCommand(BuildCommandResultMixin):
         self.shell = shell
         self.cwd = cwd or settings.RTD_DOCKER_WORKDIR
         self.user = user or settings.RTD_DOCKER_USER
-        self._environment = environment.copy() if environment else {}
+        # Shared with the environment that spawned the command; commands never
+        # mutate it, ``run`` builds its own dict from it instead
+        self._environment = environment or {}
         if 'PATH' in self._environment:
             raise BuildEnvironmentError('\'PATH\' can\'t be set. Use bin_path')
 
@@ -119,29 +205,35 @@ class BuildCommand(BuildCommandResultMixin):
         self.record_as_success = record_as_success
         self.exit_code = None
 
+        # ``self.command`` doesn't change after instantiation, cache its
+        # flattened version since it's used for logging and saving as well
+        self._command_flattened = None
+
     def __str__(self):
         # TODO do we want to expose the full command here?
-        output = ''
-        if self.output is not None:
-            output = self.output.encode('utf-8')
-        return '\n'.join([self.get_command(), output])
+        return f'{self.get_command()}\n{self.output or ""}'
 
     def run(self):
         """Set up subprocess and execute command."""
         log.info("Running build command.", command=self.get_command(), cwd=self.cwd)
 
         self.start_time = datetime.utcnow()
-        environment = self._environment.copy()
-        if 'DJANGO_SETTINGS_MODULE' in environment:
-            del environment['DJANGO_SETTINGS_MODULE']
-        if 'PYTHONPATH' in environment:
-            del environment['PYTHONPATH']
+        # Build the final environment in a single pass, dropping the variables
+        # that shouldn't leak into the command
+        environment = {
+            key: value
+            for key, value in self._environment.items()
+            if key not in ('DJANGO_SETTINGS_MODULE', 'PYTHONPATH', 'BIN_PATH')
+        }
 
         # Always copy the PATH from the host into the environment
-        env_paths = os.environ.get('PATH', '').split(':')
+        if self.build_env is not None:
+            path = self.build_env._host_path
+        else:
+            path = os.environ.get('PATH', '')
         if self.bin_path is not None:
-            env_paths.insert(0, self.bin_path)
-        environment['PATH'] = ':'.join(env_paths)
+            path = f'{self.bin_path}:{path}'
+        environment['PATH'] = path
 
         try:
             # When using ``shell=True`` the command should be flatten
@@ -152,15 +244,24 @@ class BuildCommand(BuildCommandResultMixin):
             proc = subprocess.Popen(
                 command,
                 shell=self.shell,
+                # Use the default (full) buffering for the pipes, so reading
+                # the output doesn't pay one syscall per small chunk written
+                # by the command
+                bufsize=-1,
                 cwd=self.cwd,
                 stdin=None,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 env=environment,
             )
-            cmd_stdout, cmd_stderr = proc.communicate()
-            self.output = self.sanitize_output(cmd_stdout)
-            self.error = self.sanitize_output(cmd_stderr)
+            # Read the combined stdout/stderr pipe in chunks instead of
+            # buffering the full output in memory (``communicate``), so the
+            # memory used doesn't depend on how verbose the command is
+            cmd_output = self._collect_output(
+                iter(lambda: proc.stdout.read(OUTPUT_READ_CHUNK_SIZE), b''),
+            )
+            proc.wait()
+            self.output = self.sanitize_output(cmd_output)
             self.exit_code = proc.returncode
         except OSError:
             log.exception("Operating system error.")
@@ -168,6 +269,39 @@ class BuildCommand(BuildCommandResultMixin):
         finally:
             self.end_time = datetime.utcnow()
 
+    def _allowed_output_length(self):
+        """Max length of command output to be sent over the API call request."""
+        # Left some extra space for the rest of the request data
+        threshold = 512 * 1024  # 512Kb
+        return settings.DATA_UPLOAD_MAX_MEMORY_SIZE - threshold
+
+    def _collect_output(self, chunks):
+        r"""
+        Join ``chunks`` of raw command output into a single bytes object.
+
+        The collected output is bounded to roughly the length accepted by the
+        API (see ``sanitize_output``): older chunks are discarded as new ones
+        arrive, so only the tail of a too verbose output is kept in memory.
+        NULL (\x00) characters are stripped while collecting to avoid a second
+        pass over the whole output afterwards.
+
+        :param chunks: iterable of bytes with the raw command output
+        :returns: tail of the command output as bytes
+        """
+        allowed_length = self._allowed_output_length()
+        buffered = deque()
+        buffered_length = 0
+        for chunk in chunks:
+            if b'\x00' in chunk:
+                chunk = chunk.replace(b'\x00', b'')
+            buffered.append(chunk)
+            buffered_length += len(chunk)
+            # Keep the buffer slightly above ``allowed_length``, so
+            # ``sanitize_output`` still detects that it was truncated
+            while buffered_length - len(buffered[0]) > allowed_length:
+                buffered_length -= len(buffered.popleft())
+        return b''.join(buffered)
+
     def sanitize_output(self, output):
         r"""
         Sanitize ``output`` to be saved into the DB.
@@ -186,20 +320,29 @@ class BuildCommand(BuildCommandResultMixin):
 
         :returns: sanitized output as string or ``None`` if it fails
         """
+        allowed_length = self._allowed_output_length()
         try:
+            # Chunk the output data to be less than
+            # ``DATA_UPLOAD_MAX_MEMORY_SIZE``. Truncate at the bytes level so
+            # only the tail that is kept pays for the decode and NUL scan;
+            # ``errors='replace'`` takes care of a multi-byte character split
+            # by the slice.
+            truncated = len(output) > allowed_length
+            if truncated:
+                output = output[-allowed_length:]
+
             sanitized = output.decode('utf-8', 'replace')
-            # Replace NULL (\x00) character to avoid PostgreSQL db to fail
+            # Replace NULL (\x00) character to avoid PostgreSQL db to fail.
+            # The output is normally collected with NULs already stripped
+            # (see ``_collect_output``), so scan before paying for a full
+            # replace pass over a potentially large string.
             # https://code.djangoproject.com/ticket/28201
-            sanitized = sanitized.replace('\x00', '')
+            if '\x00' in sanitized:
+                sanitized = sanitized.replace('\x00', '')
         except (TypeError, AttributeError):
-            sanitized = None
+            return None
 
-        # Chunk the output data to be less than ``DATA_UPLOAD_MAX_MEMORY_SIZE``
-        output_length = len(output) if output else 0
-        # Left some extra space for the rest of the request data
-        threshold = 512 * 1024  # 512Kb
-        allowed_length = settings.DATA_UPLOAD_MAX_MEMORY_SIZE - threshold
-        if output_length > allowed_length:
+        if truncated:
             log.info(
                 'Command output is too big.',
                 project_slug=self.build_env.project.slug,
@@ -207,31 +350,26 @@ class BuildCommand(BuildCommandResultMixin):
                 build_id=self.build_env.build.get('id'),
                 command=self.get_command(),
             )
-            truncated_output = sanitized[-allowed_length:]
             sanitized = (
                 '.. (truncated) ...\n'
                 f'Output is too big. Truncated at {allowed_length} bytes.\n\n\n'
-                f'{truncated_output}'
+                f'{sanitized}'
             )
 
         return sanitized
 
     def get_command(self):
         """Flatten command."""
-        if hasattr(self.command, '__iter__') and not isinstance(self.command, str):
-            return ' '.join(self.command)
-        return self.command
-
-    def save(self):
-        """Save this command and result via the API."""
-        # Force record this command as success to avoid Build reporting errors
-        # on commands that are just for checking purposes and do not interferes
-        # in the Build
-        if self.record_as_success:
-            log.warning('Recording command exit_code as success')
-            self.exit_code = 0
+        if self._command_flattened is None:
+            if hasattr(self.command, '__iter__') and not isinstance(self.command, str):
+                self._command_flattened = ' '.join(self.command)
+            else:
+                self._command_flattened = self.command
+        return self._command_flattened
 
-        data = {
+    def serialize(self):
+        """Serialize the command and its result to be saved via the API."""
+        return {
             'build': self.build_env.build.get('id'),
             'command': self.get_command(),
             'description': self.description,
@@ -241,7 +379,14 @@ class BuildCommand(BuildCommandResultMixin):
             'end_time': self.end_time,
         }
 
+    def save(self):
+        """Save this command and result via the API."""
+        data = self.serialize()
+
         if self.build_env.project.has_feature(Feature.API_LARGE_DATA):
+            # Avoid paying the import unless the feature is enabled
+            from requests_toolbelt.multipart.encoder import MultipartEncoder
+
             # Don't use slumber directly here. Slumber tries to enforce a string,
             # which will break our multipart encoding here.
             encoder = MultipartEncoder(
@@ -269,10 +414,14 @@ class DockerBuildCommand(BuildCommand):
     Build command to execute in docker container
     """
 
-    bash_escape_re = re.compile(
-        r"([\t\ \!\"\#\$\&\'\(\)\*\:\;\<\>\?\@"
-        r'\[\\\]\^\`\{\|\}\~])'
-    )
+    # Suspicious bash chars prefixed with ``\`` by ``_escape_command``. Most
+    # command parts don't contain any of them, so check with a (C-level)
+    # set intersection before paying for the translation.
+    bash_escape_chars = frozenset('\t !"#$&\'()*:;<>?@[\\]^`{|}~')
+    bash_escape_table = str.maketrans({
+        char: '\\' + char
+        for char in bash_escape_chars
+    })
 
     def __init__(self, *args, escape_command=True, **kwargs):
         """
@@ -283,8 +432,10 @@ class DockerBuildCommand(BuildCommand):
             trusted or internal commands.
         :type escape_command: bool
         """
+        _load_docker()
         self.escape_command = escape_command
         super().__init__(*args, **kwargs)
+        self._command_wrapped = None
 
     def run(self):
         """Execute command in existing Docker container."""
@@ -301,14 +452,23 @@ class DockerBuildCommand(BuildCommand):
             exec_cmd = client.exec_create(
                 container=self.build_env.container_id,
                 cmd=self.get_wrapped_command(),
-                environment=self._environment,
+                environment={
+                    key: value
+                    for key, value in self._environment.items()
+                    if key != 'BIN_PATH'
+                },
                 user=self.user,
                 workdir=self.cwd,
                 stdout=True,
                 stderr=True,
             )
 
-            cmd_output = client.exec_start(exec_id=exec_cmd['Id'], stream=False)
+            # Stream the container output into a bounded buffer instead of
+            # receiving it as one big bytes object, so memory stays capped
+            # no matter how verbose the command is
+            cmd_output = self._collect_output(
+                client.exec_start(exec_id=exec_cmd['Id'], stream=True),
+            )
             self.output = self.sanitize_output(cmd_output)
             cmd_ret = client.exec_inspect(exec_id=exec_cmd['Id'])
             self.exit_code = cmd_ret['ExitCode']
@@ -317,10 +477,9 @@ class DockerBuildCommand(BuildCommand):
             # was killed due to memory usage, make the error code
             # nicer. Sometimes the kernel kills the command and Docker doesn't
             # not use the specific exit code, so we check if the word `Killed`
-            # is in the last 15 lines of the command's output
-            killed_in_output = 'Killed' in '\n'.join(
-                self.output.splitlines()[-15:],
-            )
+            # is in the tail of the command's output (4Kb comfortably covers
+            # the last few lines without scanning the whole output)
+            killed_in_output = 'Killed' in self.output[-4096:]
             if self.exit_code == DOCKER_OOM_EXIT_CODE or (
                 self.exit_code == 1 and
                 killed_in_output
@@ -349,27 +508,33 @@ class DockerBuildCommand(BuildCommand):
         ``escape_command=True`` in the init method this escapes a good majority
         of those characters.
         """
+        if self._command_wrapped is not None:
+            return self._command_wrapped
+
         prefix = ''
         if self.bin_path:
             bin_path = self._escape_command(self.bin_path)
             prefix += f'PATH={bin_path}:$PATH '
 
-        command = (
-            ' '.join(
-                self._escape_command(part) if self.escape_command else part
-                for part in self.command
+        if self.escape_command:
+            command = ' '.join(
+                self._escape_command(part) for part in self.command
             )
-        )
-        return (
+        else:
+            command = ' '.join(self.command)
+        self._command_wrapped = (
             "/bin/sh -c '{prefix}{cmd}'".format(
                 prefix=prefix,
                 cmd=command,
             )
         )
+        return self._command_wrapped
 
     def _escape_command(self, cmd):
         r"""Escape the command by prefixing suspicious chars with `\`."""
-        return self.bash_escape_re.sub(r'\\\1', cmd)
+        if self.bash_escape_chars.isdisjoint(cmd):
+            return cmd
+        return cmd.translate(self.bash_escape_table)
 
 
 class BaseEnvironment:
@@ -421,14 +586,14 @@ class BaseEnvironment:
             # ``record_as_success`` is needed to instantiate the BuildCommand
             kwargs.update({'record_as_success': record_as_success})
 
-        # Remove PATH from env, and set it to bin_path if it isn't passed in
-        environment = self._environment.copy()
-        env_path = environment.pop('BIN_PATH', None)
+        # Use BIN_PATH as bin_path if it isn't passed in; the commands
+        # themselves take care of excluding it (and PATH) from the final env
+        env_path = self._environment.get('BIN_PATH')
         if 'bin_path' not in kwargs and env_path:
             kwargs['bin_path'] = env_path
         if 'environment' in kwargs:
             raise BuildEnvironmentError('environment can\'t be passed in via commands.')
-        kwargs['environment'] = environment
+        kwargs['environment'] = self._environment
 
         # ``build_env`` is passed as ``kwargs`` when it's called from a
         # ``*BuildEnvironment``
@@ -536,13 +701,28 @@ class BuildEnvironment(BaseEnvironment):
         self.update_on_success = update_on_success
 
         self.failure = None
-        self.start_time = start_time or datetime.utcnow()
+        if start_time:
+            # The timer was started by a previous environment, we can only
+            # measure the length from its wall clock time
+            self.start_time = start_time
+            self._start_monotonic = None
+        else:
+            self.start_time = datetime.utcnow()
+            # Monotonic clock to compute the build length, so it isn't
+            # affected by system clock adjustments during the build
+            self._start_monotonic = time.monotonic()
+        self._pending_commands = []
+
+        # The host PATH is copied into the environment of every command,
+        # read it once instead of once per command
+        self._host_path = os.environ.get('PATH', '')
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, tb):
         ret = self.handle_exception(exc_type, exc_value, tb)
+        self._flush_commands()
         self.update_build(BUILD_STATE_FINISHED)
         log.info(
             'Build finished',
@@ -598,7 +778,44 @@ class BuildEnvironment(BaseEnvironment):
             return True
 
     def record_command(self, command):
-        command.save()
+        # Force record this command as success to avoid Build reporting errors
+        # on commands that are just for checking purposes and do not interferes
+        # in the Build
+        if command.record_as_success:
+            log.warning('Recording command exit_code as success')
+            command.exit_code = 0
+
+        # Queue the command to be saved in a single API call when the
+        # environment finishes (see ``_flush_commands``)
+        self._pending_commands.append(command)
+
+    def _flush_commands(self):
+        """
+        Save the commands recorded during the build via the API.
+
+        All the commands are sent in a single request to avoid paying one HTTP
+        round-trip per command. Projects with the ``API_LARGE_DATA`` feature
+        save each command individually, since those are sent as multipart
+        payloads.
+        """
+        if not self._pending_commands:
+            return
+
+        try:
+            if self.project.has_feature(Feature.API_LARGE_DATA):
+                for command in self._pending_commands:
+                    command.save()
+            else:
+                api_v2.command.post([
+                    command.serialize()
+                    for command in self._pending_commands
+                ])
+        except Exception:
+            log.exception(
+                'Unable to save build commands',
+                build_id=self.build.get('id') if self.build else '',
+            )
+        self._pending_commands = []
 
     def run(self, *cmd, **kwargs):
         kwargs.update({
@@ -668,14 +885,16 @@ class BuildEnvironment(BaseEnvironment):
             ):
                 self.build['exit_code'] = self.failure.status_code
             elif self.commands:
-                self.build['exit_code'] = max([
+                self.build['exit_code'] = max(
                     cmd.exit_code for cmd in self.commands
-                ])
+                )
 
         self.build['setup'] = self.build['setup_error'] = ''
         self.build['output'] = self.build['error'] = ''
 
-        if self.start_time:
+        if self._start_monotonic is not None:
+            self.build['length'] = int(time.monotonic() - self._start_monotonic)
+        elif self.start_time:
             build_length = (datetime.utcnow() - self.start_time)
             self.build['length'] = int(build_length.total_seconds())
 
@@ -710,8 +929,9 @@ class BuildEnvironment(BaseEnvironment):
                 )
             self.build['error'] = str(self.failure)
 
-        # Attempt to stop unicode errors on build reporting
-        for key, val in list(self.build.items()):
+        # Attempt to stop unicode errors on build reporting. Only existing
+        # keys are re-assigned, so it's safe to iterate without copying.
+        for key, val in self.build.items():
             if isinstance(val, bytes):
                 self.build[key] = val.decode('utf-8', 'ignore')
 
@@ -765,11 +985,13 @@ class DockerBuildEnvironment(BuildEnvironment):
     container_time_limit = DOCKER_LIMITS.get('time')
 
     def __init__(self, *args, **kwargs):
+        _load_docker()
         self.docker_socket = kwargs.pop('docker_socket', DOCKER_SOCKET)
         super().__init__(*args, **kwargs)
         self.client = None
         self.container = None
         self.container_name = self.get_container_name()
+        self._image_hash = None
 
         # Decide what Docker image to use, based on priorities:
         # Use the Docker image set by our feature flag: ``testing`` or,
@@ -789,54 +1011,59 @@ class DockerBuildEnvironment(BuildEnvironment):
 
     def __enter__(self):
         """Start of environment context."""
-        try:
-            # Test for existing container. We remove any stale containers that
-            # are no longer running here if there is a collision. If the
-            # container is still running, this would be a failure of the version
-            # locking code, so we throw an exception.
-            state = self.container_state()
-            if state is not None:
-                if state.get('Running') is True:
-                    exc = BuildEnvironmentError(
-                        _(
-                            'A build environment is currently '
-                            'running for this version',
-                        ),
-                    )
-                    self.failure = exc
-                    if self.build:
-                        self.build['state'] = BUILD_STATE_FINISHED
-                    raise exc
-
-                log.warning(
-                    'Removing stale container.',
-                    project=self.project.slug,
-                    version=self.version.slug,
-                    container_id=self.container_id,
-                )
-                client = self.get_client()
-                client.remove_container(self.container_id)
-        except (DockerAPIError, ConnectionError):
-            # If there is an exception here, we swallow the exception as this
-            # was just during a sanity check anyways.
-            pass
-        except BuildEnvironmentError:
-            # There may have been a problem connecting to Docker altogether, or
-            # some other handled exception here.
-            self.__exit__(*sys.exc_info())
-            raise
-
         # Create the checkout path if it doesn't exist to avoid Docker creation
-        if not os.path.exists(self.project.doc_path):
-            os.makedirs(self.project.doc_path)
-
+        os.makedirs(self.project.doc_path, exist_ok=True)
+
+        # Create the container right away instead of checking for a collision
+        # first: in the normal case there is no previous container, so probing
+        # for one is a wasted round-trip to the Docker daemon. On a name
+        # conflict we remove the stale container and retry once. If the
+        # container is still running, this would be a failure of the version
+        # locking code, so we throw an exception.
         try:
-            self.create_container()
+            try:
+                self.create_container()
+            except DockerAPIError:
+                self._remove_stale_container()
+                self.create_container()
         except:  # noqa
             self.__exit__(*sys.exc_info())
             raise
         return self
 
+    def _remove_stale_container(self):
+        """
+        Remove the stale container colliding with this environment's name.
+
+        :raises: :py:class:`BuildEnvironmentError` if the container is still
+            running
+        """
+        state = self.container_state()
+        if state is not None and state.get('Running') is True:
+            exc = BuildEnvironmentError(
+                _(
+                    'A build environment is currently '
+                    'running for this version',
+                ),
+            )
+            self.failure = exc
+            if self.build:
+                self.build['state'] = BUILD_STATE_FINISHED
+            raise exc
+
+        log.warning(
+            'Removing stale container.',
+            project=self.project.slug,
+            version=self.version.slug,
+            container_id=self.container_id,
+        )
+        try:
+            self.get_client().remove_container(self.container_id, force=True)
+        except (DockerAPIError, ConnectionError):
+            # Swallow the exception here, the retried ``create_container``
+            # surfaces any real problem.
+            pass
+
     def __exit__(self, exc_type, exc_value, tb):
         """End of environment context."""
         try:
@@ -844,22 +1071,12 @@ class DockerBuildEnvironment(BuildEnvironment):
             self.update_build_from_container_state()
 
             client = self.get_client()
-            try:
-                client.kill(self.container_id)
-            except DockerNotFoundError:
-                log.info(
-                    'Container does not exists, nothing to kill.',
-                    container_id=self.container_id,
-                )
-            except DockerAPIError:
-                log.exception(
-                    'Unable to kill container.',
-                    container_id=self.container_id,
-                )
-
             try:
                 log.info('Removing container.', container_id=self.container_id)
-                client.remove_container(self.container_id)
+                # ``force=True`` kills a still running container before
+                # removing it, so teardown is a single Docker API round-trip
+                # instead of a ``kill`` followed by a ``remove``
+                client.remove_container(self.container_id, force=True, v=True)
             except DockerNotFoundError:
                 log.info(
                     'Container does not exists, nothing to remove.',
@@ -879,7 +1096,7 @@ class DockerBuildEnvironment(BuildEnvironment):
             # here. We'll catch this and report if there were no reported errors
             # already. These errors are not as important as a failure at deeper
             # code
-            if not all([exc_type, exc_value, tb]):
+            if exc_type is None or exc_value is None or tb is None:
                 exc_type, exc_value, tb = sys.exc_info()
 
         return super().__exit__(exc_type, exc_value, tb)
@@ -892,19 +1109,26 @@ class DockerBuildEnvironment(BuildEnvironment):
                 project_name=self.project.slug,
             )
         else:
-            # An uuid is added, so the container name is unique per sync.
-            uuid_ = uuid.uuid4().hex[:8]
-            name = f'sync-{uuid_}-project-{self.project.pk}-{self.project.slug}'
+            # A pid + counter tag is added, so the container name is unique
+            # per sync without paying an urandom read like ``uuid4`` does.
+            tag = f'{os.getpid():x}{next(_sync_container_count):x}'
+            name = f'sync-{tag}-project-{self.project.pk}-{self.project.slug}'
         return slugify(name[:DOCKER_HOSTNAME_MAX_LEN])
 
     def get_client(self):
-        """Create Docker client connection."""
+        """
+        Return the Docker client connection for this environment.
+
+        The client is created once and reused for every command of the build
+        (``exec_create``/``exec_start``/``exec_inspect``) as well as the
+        container lifecycle calls, so they all share the same pooled
+        connection to the Docker daemon instead of re-connecting. The client
+        itself is shared across builds (see ``get_docker_client``) and is
+        never closed by the environment.
+        """
         try:
             if self.client is None:
-                self.client = APIClient(
-                    base_url=self.docker_socket,
-                    version=DOCKER_VERSION,
-                )
+                self.client = get_docker_client(self.docker_socket)
             return self.client
         except DockerException:
             log.exception(
@@ -930,8 +1154,7 @@ class DockerBuildEnvironment(BuildEnvironment):
         It uses Docker Volume if running on a docker-compose. Otherwise, it
         returns just a regular mountpoint path.
         """
-        if getattr(settings, 'RTD_DOCKER_COMPOSE', False):
-            from pathlib import Path
+        if RTD_DOCKER_COMPOSE:
             binds = {
                 settings.RTD_DOCKER_COMPOSE_VOLUME: {
                     'bind': str(Path(self.project.doc_path).parent),
@@ -946,7 +1169,7 @@ class DockerBuildEnvironment(BuildEnvironment):
                 },
             }
 
-        binds.update(settings.RTD_DOCKER_ADDITIONAL_BINDS)
+        binds.update(RTD_DOCKER_ADDITIONAL_BINDS)
 
         return binds
 
@@ -967,14 +1190,32 @@ class DockerBuildEnvironment(BuildEnvironment):
 
     @property
     def image_hash(self):
-        """Return the hash of the Docker image."""
-        client = self.get_client()
-        image_metadata = client.inspect_image(self.container_image)
-        return image_metadata.get('Id')
+        """
+        Return the hash of the Docker image.
 
-    @property
+        The image doesn't change during the life of the environment (nor,
+        realistically, of the worker process), so the hash is fetched from
+        the Docker API only once per image per process.
+        """
+        if self._image_hash is None:
+            image_hash = _IMAGE_HASH_CACHE.get(self.container_image)
+            if image_hash is None:
+                client = self.get_client()
+                image_metadata = client.inspect_image(self.container_image)
+                image_hash = image_metadata.get('Id')
+                _IMAGE_HASH_CACHE[self.container_image] = image_hash
+            self._image_hash = image_hash
+        return self._image_hash
+
+    @cached_property
     def container_id(self):
-        """Return id of container if it is valid."""
+        """
+        Return id of container if it is valid.
+
+        The id is accessed on every Docker call and every log line of the
+        build, and it can't change once the environment is created, so it's
+        computed only once.
+        """
         if self.container_name:
             return self.container_name
 
@@ -1027,14 +1268,19 @@ class DockerBuildEnvironment(BuildEnvironment):
             )
             self.container = client.create_container(
                 image=self.container_image,
-                command=(
-                    '/bin/sh -c "sleep {time}; exit {exit}"'.format(
+                # The shell is kept because a bare ``sleep`` can't exit with
+                # ``DOCKER_TIMEOUT_EXIT_CODE``, which is how a timed out
+                # container is detected on teardown. The exec form at least
+                # saves the daemon from parsing a command string.
+                command=[
+                    '/bin/sh',
+                    '-c',
+                    'sleep {time}; exit {exit}'.format(
                         time=self.container_time_limit,
                         exit=DOCKER_TIMEOUT_EXIT_CODE,
-                    )
-                ),
+                    ),
+                ],
                 name=self.container_id,
-                hostname=self.container_id,
                 host_config=self.get_container_host_config(),
                 detach=True,
                 user=settings.RTD_DOCKER_USER,
@@ -1055,6 +1301,10 @@ class DockerBuildEnvironment(BuildEnvironment):
                 ),
             )
         except DockerAPIError as e:
+            # A name conflict (HTTP 409) means a stale container exists;
+            # propagate it so ``__enter__`` can remove the container and retry
+            if e.response is not None and e.response.status_code == 409:
+                raise
             log.exception(
                 e.explanation,
                 project_slug=self.project.slug,
@@ -2,6 +2,8 @@
 # pylint: disable=missing-docstring
 from unittest import mock
 
+from readthedocs.doc_builder import environments
+
 
 class EnvironmentMockGroup:
 
@@ -78,9 +80,13 @@ class EnvironmentMockGroup:
 
     def start(self):
         """Create a patch object for class patches."""
+        # Clients and image hashes are cached process-wide, drop anything
+        # created with a previous (mocked or real) APIClient
+        environments._DOCKER_CLIENTS.clear()
+        environments._IMAGE_HASH_CACHE.clear()
         for patch in self.patches:
             self.mocks[patch] = self.patches[patch].start()
-        self.mocks['process'].communicate.return_value = ('', '')
+        self.mocks['process'].stdout.read.return_value = b''
         self.mocks['process'].returncode = 0
         self.mocks['popen'].return_value = self.mocks['process']
         self.mocks['docker'].return_value = self.mocks['docker_client']
@@ -93,6 +99,8 @@ class EnvironmentMockGroup:
                 self.patches[patch].stop()
             except RuntimeError:
                 pass
+        environments._DOCKER_CLIENTS.clear()
+        environments._IMAGE_HASH_CACHE.clear()
 
     def configure_mock(self, mock, kwargs):
         """Configure object mocks."""
@@ -481,6 +481,52 @@ class APIBuildTests(TestCase):
         self.assertEqual(build['commands'][0]['run_time'], 5)
         self.assertEqual(build['commands'][0]['description'], 'foo')
 
+    def test_make_build_commands_in_batch(self):
+        """Create build and several build commands in a single request."""
+        client = APIClient()
+        client.login(username='super', password='test')
+        resp = client.post(
+            '/api/v2/build/',
+            {
+                'project': 1,
+                'version': 1,
+                'success': True,
+            },
+            format='json',
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        build = resp.data
+        now = datetime.datetime.utcnow()
+        resp = client.post(
+            '/api/v2/command/',
+            [
+                {
+                    'build': build['id'],
+                    'command': 'git checkout master',
+                    'description': 'Checking out repository',
+                    'exit_code': 0,
+                    'start_time': str(now - datetime.timedelta(seconds=10)),
+                    'end_time': str(now - datetime.timedelta(seconds=5)),
+                },
+                {
+                    'build': build['id'],
+                    'command': 'echo test',
+                    'description': 'foo',
+                    'exit_code': 0,
+                    'start_time': str(now - datetime.timedelta(seconds=5)),
+                    'end_time': str(now),
+                },
+            ],
+            format='json',
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = client.get('/api/v2/build/%s/' % build['id'])
+        self.assertEqual(resp.status_code, 200)
+        build = resp.data
+        self.assertEqual(len(build['commands']), 2)
+        self.assertEqual(build['commands'][0]['command'], 'git checkout master')
+        self.assertEqual(build['commands'][1]['command'], 'echo test')
+
     def test_get_raw_log_success(self):
         project = Project.objects.get(pk=1)
         version = project.versions.first()
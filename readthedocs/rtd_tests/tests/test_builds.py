@@ -236,10 +236,13 @@ class BuildEnvironmentTests(TestCase):
             ((b'', b''), 0),  # latex
         ]
         mock_obj = mock.Mock()
-        mock_obj.communicate.side_effect = [
-            output for (output, status)
-            in returns
-        ]
+        # Each command reads its (stdout, stderr) output until an empty chunk
+        reads = []
+        for (output, status) in returns:
+            if output[0]:
+                reads.append(output[0])
+            reads.append(b'')
+        mock_obj.stdout.read.side_effect = reads
         type(mock_obj).returncode = mock.PropertyMock(
             side_effect=[status for (output, status) in returns],
         )
@@ -288,10 +291,13 @@ class BuildEnvironmentTests(TestCase):
             ((b'', b''), 0),  # latex
         ]
         mock_obj = mock.Mock()
-        mock_obj.communicate.side_effect = [
-            output for (output, status)
-            in returns
-        ]
+        # Each command reads its (stdout, stderr) output until an empty chunk
+        reads = []
+        for (output, status) in returns:
+            if output[0]:
+                reads.append(output[0])
+            reads.append(b'')
+        mock_obj.stdout.read.side_effect = reads
         type(mock_obj).returncode = mock.PropertyMock(
             side_effect=[status for (output, status) in returns],
         )
@@ -1,7 +1,7 @@
 """
 Things to know:
 
-* raw subprocess calls like .communicate expects bytes
+* raw subprocess pipes expose bytes
 * the Command wrappers encapsulate the bytes and expose unicode
 """
 import hashlib
@@ -59,7 +59,7 @@ class TestLocalBuildEnvironment(TestCase):
         """Normal build in passing state."""
         self.mocks.configure_mock(
             'process', {
-                'communicate.return_value': (b'This is okay', ''),
+                'stdout.read.side_effect': [b'This is okay', b''],
             },
         )
         type(self.mocks.process).returncode = PropertyMock(return_value=0)
@@ -72,7 +72,7 @@ class TestLocalBuildEnvironment(TestCase):
 
         with build_env:
             build_env.run('echo', 'test')
-        self.assertTrue(self.mocks.process.communicate.called)
+        self.assertTrue(self.mocks.process.stdout.read.called)
         self.assertTrue(build_env.done)
         self.assertTrue(build_env.successful)
         self.assertEqual(len(build_env.commands), 1)
@@ -82,7 +82,7 @@ class TestLocalBuildEnvironment(TestCase):
         self.assertFalse(self.mocks.api()(DUMMY_BUILD_ID).put.called)
         # The command was saved
         command = build_env.commands[0]
-        self.mocks.mocks['api_v2.command'].post.assert_called_once_with({
+        self.mocks.mocks['api_v2.command'].post.assert_called_once_with([{
             'build': DUMMY_BUILD_ID,
             'command': command.get_command(),
             'description': command.description,
@@ -90,7 +90,7 @@ class TestLocalBuildEnvironment(TestCase):
             'exit_code': 0,
             'start_time': command.start_time,
             'end_time': command.end_time,
-        })
+        }])
         self.mocks.mocks['api_v2.build']().put.assert_called_with({
             'id': DUMMY_BUILD_ID,
             'version': self.version.pk,
@@ -110,7 +110,7 @@ class TestLocalBuildEnvironment(TestCase):
         """Normal build in passing state with no command recorded."""
         self.mocks.configure_mock(
             'process', {
-                'communicate.return_value': (b'This is okay', ''),
+                'stdout.read.side_effect': [b'This is okay', b''],
             },
         )
         type(self.mocks.process).returncode = PropertyMock(return_value=0)
@@ -123,7 +123,7 @@ class TestLocalBuildEnvironment(TestCase):
 
         with build_env:
             build_env.run('echo', 'test', record=False)
-        self.assertTrue(self.mocks.process.communicate.called)
+        self.assertTrue(self.mocks.process.stdout.read.called)
         self.assertTrue(build_env.done)
         self.assertTrue(build_env.successful)
         self.assertEqual(len(build_env.commands), 0)
@@ -149,7 +149,7 @@ class TestLocalBuildEnvironment(TestCase):
     def test_record_command_as_success(self):
         self.mocks.configure_mock(
             'process', {
-                'communicate.return_value': (b'This is okay', ''),
+                'stdout.read.side_effect': [b'This is okay', b''],
             },
         )
         type(self.mocks.process).returncode = PropertyMock(return_value=1)
@@ -162,7 +162,7 @@ class TestLocalBuildEnvironment(TestCase):
 
         with build_env:
             build_env.run('echo', 'test', record_as_success=True)
-        self.assertTrue(self.mocks.process.communicate.called)
+        self.assertTrue(self.mocks.process.stdout.read.called)
         self.assertTrue(build_env.done)
         self.assertTrue(build_env.successful)
         self.assertEqual(len(build_env.commands), 1)
@@ -172,7 +172,7 @@ class TestLocalBuildEnvironment(TestCase):
         self.assertFalse(self.mocks.api()(DUMMY_BUILD_ID).put.called)
         # The command was saved
         command = build_env.commands[0]
-        self.mocks.mocks['api_v2.command'].post.assert_called_once_with({
+        self.mocks.mocks['api_v2.command'].post.assert_called_once_with([{
             'build': DUMMY_BUILD_ID,
             'command': command.get_command(),
             'description': command.description,
@@ -180,7 +180,7 @@ class TestLocalBuildEnvironment(TestCase):
             'exit_code': 0,
             'start_time': command.start_time,
             'end_time': command.end_time,
-        })
+        }])
         self.mocks.mocks['api_v2.build']().put.assert_called_with({
             'id': DUMMY_BUILD_ID,
             'version': self.version.pk,
@@ -235,7 +235,7 @@ class TestLocalBuildEnvironment(TestCase):
         """Build in failing state."""
         self.mocks.configure_mock(
             'process', {
-                'communicate.return_value': (b'This is not okay', ''),
+                'stdout.read.side_effect': [b'This is not okay', b''],
             },
         )
         type(self.mocks.process).returncode = PropertyMock(return_value=1)
@@ -249,7 +249,7 @@ class TestLocalBuildEnvironment(TestCase):
         with build_env:
             build_env.run('echo', 'test')
             self.fail('This should be unreachable')
-        self.assertTrue(self.mocks.process.communicate.called)
+        self.assertTrue(self.mocks.process.stdout.read.called)
         self.assertTrue(build_env.done)
         self.assertTrue(build_env.failed)
         self.assertEqual(len(build_env.commands), 1)
@@ -259,7 +259,7 @@ class TestLocalBuildEnvironment(TestCase):
         self.assertFalse(self.mocks.api()(DUMMY_BUILD_ID).put.called)
         # The command was saved
         command = build_env.commands[0]
-        self.mocks.mocks['api_v2.command'].post.assert_called_once_with({
+        self.mocks.mocks['api_v2.command'].post.assert_called_once_with([{
             'build': DUMMY_BUILD_ID,
             'command': command.get_command(),
             'description': command.description,
@@ -267,7 +267,7 @@ class TestLocalBuildEnvironment(TestCase):
             'exit_code': 1,
             'start_time': command.start_time,
             'end_time': command.end_time,
-        })
+        }])
         self.mocks.mocks['api_v2.build']().put.assert_called_with({
             'id': DUMMY_BUILD_ID,
             'version': self.version.pk,
@@ -294,7 +294,7 @@ class TestLocalBuildEnvironment(TestCase):
         with build_env:
             raise BuildEnvironmentError('Foobar')
 
-        self.assertFalse(self.mocks.process.communicate.called)
+        self.assertFalse(self.mocks.process.stdout.read.called)
         self.assertEqual(len(build_env.commands), 0)
         self.assertTrue(build_env.done)
         self.assertTrue(build_env.failed)
@@ -329,7 +329,7 @@ class TestLocalBuildEnvironment(TestCase):
         with build_env:
             raise ValueError('uncaught')
 
-        self.assertFalse(self.mocks.process.communicate.called)
+        self.assertFalse(self.mocks.process.stdout.read.called)
         self.assertTrue(build_env.done)
         self.assertTrue(build_env.failed)
 
@@ -578,7 +578,7 @@ class TestDockerBuildEnvironment(TestCase):
         self.assertFalse(self.mocks.api()(DUMMY_BUILD_ID).put.called)
         # The command was saved
         command = build_env.commands[0]
-        self.mocks.mocks['api_v2.command'].post.assert_called_once_with({
+        self.mocks.mocks['api_v2.command'].post.assert_called_once_with([{
             'build': DUMMY_BUILD_ID,
             'command': command.get_command(),
             'description': command.description,
@@ -586,7 +586,7 @@ class TestDockerBuildEnvironment(TestCase):
             'exit_code': -1,
             'start_time': command.start_time,
             'end_time': command.end_time,
-        })
+        }])
         self.mocks.mocks['api_v2.build']().put.assert_called_with({
             'id': DUMMY_BUILD_ID,
             'version': self.version.pk,
@@ -603,10 +603,15 @@ class TestDockerBuildEnvironment(TestCase):
         })
 
     def test_api_failure_on_error_in_exit(self):
-        response = Mock(status_code=500, reason='Internal Server Error')
+        response = Mock(status_code=404, reason='Not Found')
         self.mocks.configure_mock(
             'docker_client', {
-                'kill.side_effect': BuildEnvironmentError('Failed'),
+                'inspect_container.side_effect': DockerAPIError(
+                    'No container found',
+                    response,
+                    'No container found',
+                ),
+                'remove_container.side_effect': BuildEnvironmentError('Failed'),
             },
         )
 
@@ -645,10 +650,15 @@ class TestDockerBuildEnvironment(TestCase):
         Don't report a connection problem to Docker on cleanup if we have a more
         usable error to show the user.
         """
-        response = Mock(status_code=500, reason='Internal Server Error')
+        response = Mock(status_code=404, reason='Not Found')
         self.mocks.configure_mock(
             'docker_client', {
-                'kill.side_effect': BuildEnvironmentError('Outer failed'),
+                'inspect_container.side_effect': DockerAPIError(
+                    'No container found',
+                    response,
+                    'No container found',
+                ),
+                'remove_container.side_effect': BuildEnvironmentError('Outer failed'),
             },
         )
 
@@ -685,7 +695,7 @@ class TestDockerBuildEnvironment(TestCase):
         self.mocks.configure_mock(
             'docker_client', {
                 'exec_create.return_value': {'Id': b'container-foobar'},
-                'exec_start.return_value': b'This is the return',
+                'exec_start.return_value': [b'This is the return'],
                 'exec_inspect.return_value': {'ExitCode': 1},
             },
         )
@@ -717,7 +727,7 @@ class TestDockerBuildEnvironment(TestCase):
         self.assertFalse(self.mocks.api()(DUMMY_BUILD_ID).put.called)
         # The command was saved
         command = build_env.commands[0]
-        self.mocks.mocks['api_v2.command'].post.assert_called_once_with({
+        self.mocks.mocks['api_v2.command'].post.assert_called_once_with([{
             'build': DUMMY_BUILD_ID,
             'command': command.get_command(),
             'description': command.description,
@@ -725,7 +735,7 @@ class TestDockerBuildEnvironment(TestCase):
             'exit_code': 1,
             'start_time': command.start_time,
             'end_time': command.end_time,
-        })
+        }])
         self.mocks.mocks['api_v2.build']().put.assert_called_with({
             'id': DUMMY_BUILD_ID,
             'version': self.version.pk,
@@ -746,7 +756,7 @@ class TestDockerBuildEnvironment(TestCase):
         self.mocks.configure_mock(
             'docker_client', {
                 'exec_create.return_value': {'Id': b'container-foobar'},
-                'exec_start.return_value': b'This is the return',
+                'exec_start.return_value': [b'This is the return'],
                 'exec_inspect.return_value': {'ExitCode': 1},
             },
         )
@@ -794,7 +804,7 @@ class TestDockerBuildEnvironment(TestCase):
         self.mocks.configure_mock(
             'docker_client', {
                 'exec_create.return_value': {'Id': b'container-foobar'},
-                'exec_start.return_value': b'This is the return',
+                'exec_start.return_value': [b'This is the return'],
                 'exec_inspect.return_value': {'ExitCode': 1},
             },
         )
@@ -826,7 +836,7 @@ class TestDockerBuildEnvironment(TestCase):
         self.assertFalse(self.mocks.api()(DUMMY_BUILD_ID).put.called)
         # The command was saved
         command = build_env.commands[0]
-        self.mocks.mocks['api_v2.command'].post.assert_called_once_with({
+        self.mocks.mocks['api_v2.command'].post.assert_called_once_with([{
             'build': DUMMY_BUILD_ID,
             'command': command.get_command(),
             'description': command.description,
@@ -834,7 +844,7 @@ class TestDockerBuildEnvironment(TestCase):
             'exit_code': 0,
             'start_time': command.start_time,
             'end_time': command.end_time,
-        })
+        }])
         self.mocks.mocks['api_v2.build']().put.assert_called_with({
             'id': DUMMY_BUILD_ID,
             'version': self.version.pk,
@@ -856,12 +866,12 @@ class TestDockerBuildEnvironment(TestCase):
         self.mocks.configure_mock(
             'docker_client', {
                 'exec_create.return_value': {'Id': b'container-foobar'},
-                'exec_start.return_value': b'This is the return',
+                'exec_start.return_value': [b'This is the return'],
                 'exec_inspect.return_value': {'ExitCode': 0},
-                'kill.side_effect': DockerAPIError(
-                    'Failure killing container',
+                'remove_container.side_effect': DockerAPIError(
+                    'Failure removing container',
                     response,
-                    'Failure killing container',
+                    'Failure removing container',
                 ),
             },
         )
@@ -874,8 +884,10 @@ class TestDockerBuildEnvironment(TestCase):
         with build_env:
             build_env.run('echo', 'test', cwd='/tmp')
 
-        self.mocks.docker_client.kill.assert_called_with(
+        self.mocks.docker_client.remove_container.assert_called_with(
             'build-123-project-6-pip',
+            force=True,
+            v=True,
         )
         self.assertTrue(build_env.successful)
 
@@ -883,7 +895,7 @@ class TestDockerBuildEnvironment(TestCase):
         self.assertFalse(self.mocks.api()(DUMMY_BUILD_ID).put.called)
         # The command was saved
         command = build_env.commands[0]
-        self.mocks.mocks['api_v2.command'].post.assert_called_once_with({
+        self.mocks.mocks['api_v2.command'].post.assert_called_once_with([{
             'build': DUMMY_BUILD_ID,
             'command': command.get_command(),
             'description': command.description,
@@ -891,7 +903,7 @@ class TestDockerBuildEnvironment(TestCase):
             'exit_code': 0,
             'start_time': command.start_time,
             'end_time': command.end_time,
-        })
+        }])
         self.mocks.mocks['api_v2.build']().put.assert_called_with({
             'id': DUMMY_BUILD_ID,
             'version': self.version.pk,
@@ -909,11 +921,17 @@ class TestDockerBuildEnvironment(TestCase):
 
     def test_container_already_exists(self):
         """Docker container already exists."""
+        response = Mock(status_code=409, reason='Conflict')
         self.mocks.configure_mock(
             'docker_client', {
+                'create_container.side_effect': DockerAPIError(
+                    'Conflict. The container name is already in use.',
+                    response,
+                    'Conflict. The container name is already in use.',
+                ),
                 'inspect_container.return_value': {'State': {'Running': True}},
                 'exec_create.return_value': {'Id': b'container-foobar'},
-                'exec_start.return_value': b'This is the return',
+                'exec_start.return_value': [b'This is the return'],
                 'exec_inspect.return_value': {'ExitCode': 0},
             },
         )
@@ -957,19 +975,13 @@ class TestDockerBuildEnvironment(TestCase):
 
     def test_container_timeout(self):
         """Docker container timeout and command failure."""
-        response = Mock(status_code=404, reason='Container not found')
         self.mocks.configure_mock(
             'docker_client', {
-                'inspect_container.side_effect': [
-                    DockerAPIError(
-                        'No container found',
-                        response,
-                        'No container found',
-                    ),
-                    {'State': {'Running': False, 'ExitCode': 42}},
-                ],
+                'inspect_container.return_value': {
+                    'State': {'Running': False, 'ExitCode': 42},
+                },
                 'exec_create.return_value': {'Id': b'container-foobar'},
-                'exec_start.return_value': b'This is the return',
+                'exec_start.return_value': [b'This is the return'],
                 'exec_inspect.return_value': {'ExitCode': 0},
             },
         )
@@ -990,7 +1002,7 @@ class TestDockerBuildEnvironment(TestCase):
         self.assertFalse(self.mocks.api()(DUMMY_BUILD_ID).put.called)
         # The command was saved
         command = build_env.commands[0]
-        self.mocks.mocks['api_v2.command'].post.assert_called_once_with({
+        self.mocks.mocks['api_v2.command'].post.assert_called_once_with([{
             'build': DUMMY_BUILD_ID,
             'command': command.get_command(),
             'description': command.description,
@@ -998,7 +1010,7 @@ class TestDockerBuildEnvironment(TestCase):
             'exit_code': 0,
             'start_time': command.start_time,
             'end_time': command.end_time,
-        })
+        }])
         self.mocks.mocks['api_v2.build']().put.assert_called_with({
             'id': DUMMY_BUILD_ID,
             'version': self.version.pk,
@@ -1061,7 +1073,7 @@ class TestBuildCommand(TestCase):
             self.assertEqual(cmd.output, 'FOOBAR')
 
             # Check that we sanitize the output
-            self.assertEqual(sanitize_output.call_count, 2)
+            self.assertEqual(sanitize_output.call_count, 1)
 
     def test_error_output(self):
         """Test error output from command."""
@@ -1084,7 +1096,7 @@ class TestBuildCommand(TestCase):
     def test_unicode_output(self, mock_subprocess):
         """Unicode output from command."""
         mock_process = Mock(**{
-            'communicate.return_value': (SAMPLE_UTF8_BYTES, b''),
+            'stdout.read.side_effect': [SAMPLE_UTF8_BYTES, b''],
         })
         mock_subprocess.return_value = mock_process
 
@@ -1137,7 +1149,7 @@ class TestDockerBuildCommand(TestCase):
         self.mocks.configure_mock(
             'docker_client', {
                 'exec_create.return_value': {'Id': b'container-foobar'},
-                'exec_start.return_value': SAMPLE_UTF8_BYTES,
+                'exec_start.return_value': [SAMPLE_UTF8_BYTES],
                 'exec_inspect.return_value': {'ExitCode': 0},
             },
         )
@@ -1159,7 +1171,7 @@ class TestDockerBuildCommand(TestCase):
         self.mocks.configure_mock(
             'docker_client', {
                 'exec_create.return_value': {'Id': b'container-foobar'},
-                'exec_start.return_value': b'Killed\n',
+                'exec_start.return_value': [b'Killed\n'],
                 'exec_inspect.return_value': {'ExitCode': 137},
             },
         )
@@ -3,6 +3,7 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_process_init
 from django.conf import settings
 
 from django_structlog.celery.steps import DjangoStructLogInitStep
@@ -25,4 +26,13 @@ def create_application():
     return application
 
 
+@worker_process_init.connect
+def warm_docker_connection(**kwargs):
+    """Open the Docker API connection before the first build needs it."""
+    if settings.DOCKER_ENABLE:
+        # Import here, the module pulls in most of the build machinery
+        from readthedocs.doc_builder.environments import warm_docker_client
+        warm_docker_client()
+
+
 app = create_application()  # pylint: disable=invalid-name